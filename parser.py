@@ -37,15 +37,16 @@ Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
 """
 
 from types import *
+from array import array
+from collections import deque
 import re
-import string  # Delete this?
 import sys
 
 import os
 import os.path
 
-import shelve
-import dbm
+import pickle
+import hashlib
 
 # set elements are mutable objects; we cannot use sets
 import yappy.osets as osets
@@ -56,7 +57,7 @@ import yappy.osets as osets
 
 _DEBUG = 0
 
-_Version = "1.9.4"
+_Version = "1.9.7"
 
 NIL = ""
 
@@ -116,9 +117,32 @@ class Lexer:
             self.rules.append((rec, funct))
 
             rnumber = rnumber + 1
+        self._catchall = None
+        fused_rules = rules_list
+        if rules_list and rules_list[-1][0] == ".*":
+            """A final ".*" rule is the usual catch-all idiom: applied
+            last it can only match the gaps left by the other rules, so
+            the fused RE omits it and the gaps are fed to its function"""
+            self._catchall = rules_list[-1][1]
+            fused_rules = rules_list[:-1]
+        self._combined = self._build_combined(fused_rules)
+        self._dispatch = [r[1] for r in fused_rules]
         if _DEBUG and "operators" in self.__dict__:
             print("operators %s " % self.operators)
 
+    @classmethod
+    def _build_combined(cls, rules_list):
+        """Fuses all rules in a single alternation RE, one named group
+        per rule, so the whole input can be scanned in one pass.
+
+        @return: the compiled combined RE or C{None} if the rules
+        cannot be fused (e.g. they contain conflicting group names)"""
+        try:
+            return re.compile("|".join("(?P<r%d>%s)" % (i, r[0])
+                                       for i, r in enumerate(rules_list)))
+        except re.error:
+            return None
+
     def scan(self, string):
         """Performs the lexical analysis on C{string}
 
@@ -136,31 +160,71 @@ class Lexer:
 
         @param st: is a list of strings and already matched structures
         """
-        re = rule[0]
+        search = rule[0].search
         fun = rule[1]
         st1 = []
+        append = st1.append
         for s in st:
             if not isinstance(s, str):
-                st1.append(s)
+                append(s)
             else:
-                s1 = s
-                while True:
-                    m = re.search(s1)
+                # scan with an integer cursor instead of re-slicing s, so
+                # each rule pass is linear in the input length
+                pos = 0
+                s_len = len(s)
+                while pos < s_len:
+                    m = search(s, pos)
                     if not m:
-                        st1.append(s1)
+                        append(s[pos:])
                         break
-                    else:
-                        if m.start() != 0:
-                            st1.append(s1[0:m.start()])
-                        # if fun == "":
-                        #     st1.append(("", s1[m.start():m.end()]))
-                        # else:
-                        if fun != "":
-                            st1.append(fun(*[s1[m.start():m.end()]]))
-                        if m.end() == len(s1):
-                            break
-                        else:
-                            s1 = s1[m.end():]
+                    start = m.start()
+                    if start != pos:
+                        append(s[pos:start])
+                    # if fun == "":
+                    #     append(("", s[start:m.end()]))
+                    # else:
+                    if fun != "":
+                        append(fun(s[start:m.end()]))
+                    pos = m.end()
+        return st1
+
+    def scan_fused(self, string):
+        """Performs the lexical analysis on C{string} with the fused
+        RE, in a single left-to-right pass instead of one pass per rule.
+
+        At a given position earlier rules still win over later ones,
+        but contrary to L{scan} a later rule matching at an earlier
+        position wins over an earlier rule matching further right; for
+        rule lists where this matters (none of the usual ones) use
+        L{scan}.
+
+        Gaps between matches become C{("@UNK", string)} pairs, or are
+        handed to the catch-all rule's function if the rule list ends
+        with a C{".*"} rule.
+
+        @return: same structure as L{scan}"""
+        st1 = []
+        append = st1.append
+        dispatch = self._dispatch
+        catchall = self._catchall
+        pos = 0
+        for m in self._combined.finditer(string):
+            if m.start() != pos:
+                gap = string[pos:m.start()]
+                if catchall is None:
+                    append(("@UNK", gap))
+                elif catchall != "":
+                    append(catchall(gap))
+            fun = dispatch[int(m.lastgroup[1:])]
+            if fun != "":
+                append(fun(m.group()))
+            pos = m.end()
+        if pos < len(string):
+            gap = string[pos:]
+            if catchall is None:
+                append(("@UNK", gap))
+            elif catchall != "":
+                append(catchall(gap))
         return st1
 
     def scanUnknown(self, st):
@@ -168,11 +232,12 @@ class Lexer:
 
         Unknown parts will be of the form ("@UNK", string ) """
         st1 = []
+        append = st1.append
         for s in st:
             if isinstance(s, str):
-                st1.append(("@UNK", s))
+                append(("@UNK", s))
             else:
-                st1.append(s)
+                append(s)
         return st1
 
     def readscan(self):
@@ -317,7 +382,12 @@ class CFGrammar:
         Special symbols: C{@S}, C{$}, C{#}
         """
         """ MUST BE IN THIS ORDER"""
-        self.rules = grammar
+        """ intern every symbol once: all the dictionaries built over
+        the grammar (ntr, first, follow, ACTION, ...) then hash and
+        compare their keys identity-first """
+        intern = sys.intern
+        self.rules = [(intern(r[0]), [intern(x) for x in r[1]])
+                      + tuple(r[2:]) for r in grammar]
         self.makenonterminals()
         self.maketerminals()
         self.start = self.rules[0][0]
@@ -328,16 +398,19 @@ class CFGrammar:
         self.terminals.append(self.endmark)
         self.terminals.append(self.dummy)
         self.nonterminals.append(self.aug_start)
+        """ set counterparts for O(1) membership tests; the lists are
+        kept for deterministic iteration order """
+        self.terminals_set = set(self.terminals)
+        self.nonterminals_set = set(self.nonterminals)
+        """ cache for FIRST/nullability of rule rhs suffixes """
+        self._suffix_first = {}
         """ ritems are only for control ... not needed """
         self.ritems = []
         """ ntr[A] is the set of rules which has A as left side"""
         self.ntr = {}
         i = 0
         for r in self.rules:
-            if r[0] not in self.ntr:
-                self.ntr[r[0]] = [i]
-            else:
-                self.ntr[r[0]].append(i)
+            self.ntr.setdefault(r[0], []).append(i)
             for j in range(len(r[1]) + 1):
                 self.ritems.append((i, j))
             i = i + 1
@@ -346,12 +419,12 @@ class CFGrammar:
         """Grammar rules
            @return: a string representing the grammar rules
         """
-        s = ""
+        parts = []
         for n in range(len(self.rules)):
             lhs = self.rules[n][0]
             rhs = self.rules[n][1]
-            s = s + "%s | %s -> %s \n" % (n, lhs, " ".join(rhs))
-        return "Grammar Rules:\n\n%s" % s
+            parts.append("%s | %s -> %s \n" % (n, lhs, " ".join(rhs)))
+        return "Grammar Rules:\n\n%s" % "".join(parts)
 
     def makeFFN(self):
         self.NULLABLE()
@@ -362,16 +435,21 @@ class CFGrammar:
         """Extracts C{terminals} from the rules.
         C{nonterminals} must already exist"""
         self.terminals = []
+        nts = set(self.nonterminals)
+        seen = set()
         for r in self.rules:
             for s in r[1]:
-                if s not in self.nonterminals and s not in self.terminals:
+                if s not in nts and s not in seen:
+                    seen.add(s)
                     self.terminals.append(s)
 
     def makenonterminals(self):
         """Extracts C{nonterminals}  from grammar rules."""
         self.nonterminals = []
+        seen = set()
         for r in self.rules:
-            if r[0] not in self.nonterminals:
+            if r[0] not in seen:
+                seen.add(r[0])
                 self.nonterminals.append(r[0])
 
     def NULLABLE(self):
@@ -379,45 +457,70 @@ class CFGrammar:
         self.nullable = {}
         for s in self.terminals:
             self.nullable[s] = 0
-        # CGO: find the NTs with epsilon rules
         for s in self.nonterminals:
             self.nullable[s] = 0
-            if s in self.ntr:  # CGO: in case a NT has no productions
-                for i in self.ntr[s]:
-                    if not self.rules[i][1]:  # CGO: the rule has no rhs
-                        self.nullable[s] = 1
-                        break
-        # CGO: find the rest of NTs which are nullable
-        k = 1  # CGO: k=1 <=> change=True
-        while k == 1:
-            k = 0  # CGO: k=0 <=> change=False
-            for r in self.rules:  # CGO: for lhs,rhs,sact in self.rules:
-                e = 0  # CGO: rhsIsNotNullable=False 
-                for i in r[1]:  # CGO: for s in rhs:
-                    if not self.nullable[i]:
-                        e = 1  # CGO: rhsIsNotNullable=True 
-                        break
-                # if rhs is nullable and lhs is nor marked as nullable
-                if e == 0 and not self.nullable[r[0]]:
-                    self.nullable[r[0]] = 1
-                    k = 1  # CGO: k=1 <=> change=True
+        # CGO: worklist version: each rule keeps a count of rhs symbols
+        #      not yet known nullable; when a symbol becomes nullable the
+        #      counts of the rules it occurs in are decremented, and a
+        #      rule reaching zero makes its lhs nullable.  Each rhs
+        #      occurrence is touched at most once, instead of once per
+        #      sweep of the old whole-grammar fixpoint loop.
+        nullable = self.nullable
+        rules = self.rules
+        counts = []
+        occurs = {}
+        queue = []
+        for n in range(len(rules)):
+            lhs, rhs = rules[n][0], rules[n][1]
+            counts.append(len(rhs))
+            for s in rhs:
+                occurs.setdefault(s, []).append(n)
+            if not rhs and not nullable[lhs]:
+                # CGO: the rule has no rhs
+                nullable[lhs] = 1
+                queue.append(lhs)
+        while queue:
+            s = queue.pop()
+            for n in occurs.get(s, []):
+                counts[n] -= 1
+                if counts[n] == 0:
+                    lhs = rules[n][0]
+                    if not nullable[lhs]:
+                        nullable[lhs] = 1
+                        queue.append(lhs)
 
     def FIRST(self, s):
         """C{FIRST(s)} is the set of terminals that begin the strings
         derived from s """
-        first = osets.Set([])
-        e = 0
+        first = set()
         for i in range(len(s)):
-            first.s_extend(self.first[s[i]])
+            first |= self.first[s[i]]
             if not self.nullable[s[i]]:
-                e = 1
                 break
-        if e == 0:
-            self.nullable[" ".join(s)] = 1
-        else:
-            self.nullable[" ".join(s)] = 0
         return first
 
+    def _suffix_first_of(self, rule_i, j):
+        """C{FIRST} and nullability of the rhs suffix
+        C{self.rules[rule_i][1][j:]}, cached by C{(rule_i, j)}; the
+        rules do not change after construction so the cache is never
+        invalidated
+
+        @return: a pair C{(first_set, is_nullable)}"""
+        try:
+            return self._suffix_first[(rule_i, j)]
+        except KeyError:
+            pass
+        first = set()
+        e = 0
+        for s in self.rules[rule_i][1][j:]:
+            first |= self.first[s]
+            if not self.nullable[s]:
+                e = 1
+                break
+        res = (first, e == 0)
+        self._suffix_first[(rule_i, j)] = res
+        return res
+
     def FIRST_ONE(self):
         """Determines  C{FIRST(s)}, for every symbol s, that is the set of
         terminals that begin the strings derived from s """
@@ -425,64 +528,101 @@ class CFGrammar:
         self.nd = {}
         self.ms = Stack()
         for s in self.terminals:  # CGO rule 1 for the first
-            self.first[s] = osets.Set([s])
+            self.first[s] = {s}
         for s in self.nonterminals:
             if s in self.ntr and s not in self.first:
                 # self.FIRST_NT(s)
                 self.FIRST_TRA(s, 1)
 
-    def FIRST_TRA(self, s, d):
-        """Transitive closure of C{FIRST(X)} """
-        self.ms.push(s)
-        self.nd[s] = d
-        """ calculating F1(s)"""
-        self.first[s] = osets.Set([])
-        for i in self.ntr[s]:
-            for y in self.rules[i][1]:
-                if self.nullable[y]:
-                    continue
-                else:
-                    if y in self.terminals:
-                        self.first[s].append(y)
-                    break
-        """transitive closure"""
+    def _first_deps(self, s):
+        """Nonterminals whose C{FIRST} feeds C{FIRST(s)}: for each rule
+        of C{s}, the leading rhs nonterminals up to (and including) the
+        first non-nullable one"""
+        deps = []
         for i in self.ntr[s]:
             for y in self.rules[i][1]:
-                if y in self.nonterminals:
-                    if y not in self.first:
-                        self.FIRST_TRA(y, d+1)
-                    if y in self.nd and self.nd[y] != -1:
-                        self.nd[s] = min(self.nd[s], self.nd[y])
-                    self.first[s].s_extend(self.first[y])
-                    if self.nullable[y]:
-                        continue
-                    else:
+                if y in self.nonterminals_set:
+                    deps.append(y)
+                    if not self.nullable[y]:
                         break
                 else:
                     break
-        if self.nd[s] == d:
-            while 1:
-                y = self.ms.pop()
-                if y == s:
-                    break
-                self.first[y] = self.first[s].copy()
-                self.nd[y] = -1
+        return deps
+
+    def FIRST_TRA(self, s, d):
+        """Transitive closure of C{FIRST(X)}, iteratively: an explicit
+        frame stack replaces the recursion so that deep grammars cannot
+        hit the Python recursion limit.  Each frame is
+        C{[symbol, depth, dependency iterator, pending dependency]}"""
+        first = self.first
+        nd = self.nd
+        nullable = self.nullable
+        terminals_set = self.terminals_set
+        work = [[s, d, None, None]]
+        while work:
+            frame = work[-1]
+            s, d = frame[0], frame[1]
+            if frame[2] is None:
+                self.ms.push(s)
+                nd[s] = d
+                """ calculating F1(s)"""
+                first[s] = set()
+                for i in self.ntr[s]:
+                    for y in self.rules[i][1]:
+                        if nullable[y]:
+                            continue
+                        else:
+                            if y in terminals_set:
+                                first[s].add(y)
+                            break
+                frame[2] = iter(self._first_deps(s))
+            """transitive closure"""
+            it = frame[2]
+            y = frame[3]
+            frame[3] = None
+            descend = False
+            while True:
+                if y is None:
+                    y = next(it, None)
+                    if y is None:
+                        break
+                    if y not in first:
+                        """ the recursive call: push a frame and redo
+                        y once it is resolved """
+                        frame[3] = y
+                        work.append([y, d+1, None, None])
+                        descend = True
+                        break
+                if y in nd and nd[y] != -1:
+                    nd[s] = min(nd[s], nd[y])
+                first[s] |= first[y]
+                y = None
+            if descend:
+                continue
+            if nd[s] == d:
+                while 1:
+                    y = self.ms.pop()
+                    if y == s:
+                        break
+                    first[y] = set(first[s])
+                    nd[y] = -1
+            work.pop()
 
     def FIRST_NT(self, s):
         """Recursively computes C{FIRST(X)} for a nonterminal  X"""
         if s not in self.ntr:
             return
-        self.first[s] = osets.Set([])
-        for i in self.ntr[s]: 
+        self.first[s] = set()
+        for i in self.ntr[s]:
             r = self.rules[i][1]  # CGO rhs = self.rules[i][1]
             if r == []:
-                self.nullable[s] = 1 
+                self.nullable[s] = 1
             else:
                 e = 1  # CGO rhsIsNullable=True
-                for y in r:  # CGO for symbol in rhs 
-                    if not self.first.has_key(y):
+                for y in r:  # CGO for symbol in rhs
+                    if y not in self.first:
                         self.FIRST_NT(y)
-                    self.first[s].s_extend(self.first[y])
+                    self.first[s] |= self.first[y]
                     if not self.nullable[y]:
                         e = 0  # CGO rhsIsNullable=False
                         break
@@ -493,52 +633,53 @@ class CFGrammar:
         """computes C{FOLLOW(A)} for all nonterminals: the set of
         terminals a that can appear immediately to the right of A in some
         sentential form."""
-        self.follow = {}
-        self.follow[self.start] = osets.Set([self.endmark])  # CGO rule 1
-        for rule in self.rules:  # CGO if X-> alp A bet, FIRST(bet) in FOLLOW(A)
-            r = rule[1]
+        follow = self.follow = {}
+        follow[self.start] = {self.endmark}  # CGO rule 1
+        rules = self.rules
+        nts_set = self.nonterminals_set
+        suffix_first_of = self._suffix_first_of
+        for ri in range(len(rules)):
+            # CGO if X-> alp A bet, FIRST(bet) in FOLLOW(A)
+            r = rules[ri][1]
             for i in range(len(r)):
-                if r[i] in self.nonterminals:
-                    if r[i] not in self.follow:
-                        self.follow[r[i]] = osets.Set([])
-                    j = i + 1
-                    # CGO as a side effect of FIRST(r[j:]) from now on
-                    #     we know which r[j:] are nullables
-                    self.follow[r[i]].s_extend(self.FIRST(r[j:]))
-        e = 1  # CGO anychanges=True      
-        while e:  # CGO while anychanges:
-            e = 0  # CGO anychanges=False
-            for s in self.nonterminals:
-                for i in self.ntr[s]:
-                    r = self.rules[i][1]  # CGO rhs = self.rules[i][1]
-                    try:  # CGO if A-> alp B, FOLLOW(A) in FOLLOW(B)
-                        b = r[len(r)-1]
-                        if (b in self.nonterminals and
-                                self.follow[b].s_extend(self.follow[s])):
-                            e = 1  # CGO anychanges=True 
-                    except IndexError:
-                        pass
-                    except KeyError:
-                        pass
-                    for k in range(len(r)-1):
-                        j = k + 1
-                        # CGO we know which r[j:] are nullables from before
-                        if (r[k] in self.nonterminals and
-                                self.nullable[" ".join(r[j:])]):
-                            if self.follow[r[k]].s_extend(self.follow[s]):
-                                e = 1  # CGO anychanges=True 
-                                break  # CGO: This was an ERROR in Yappy.
-                                       # It was incorrectly indented outside of
-                                       # the if. As a consequence of this in a
-                                       # grammar like this:
-                                       #   S -> B C D A ;
-                                       #   A -> n A | ;
-                                       #   B -> t  ;
-                                       #   C -> b D e | ;
-                                       #   D -> i E |   ;
-                                       #   E -> S f | p ;
-                                       # FOLLOW(C) was {i, n}
-                                       # instead of {i, n, $, f}
+                if r[i] in nts_set:
+                    if r[i] not in follow:
+                        follow[r[i]] = set()
+                    follow[r[i]] |= suffix_first_of(ri, i + 1)[0]
+        # CGO if A -> alp B bet with bet nullable (in particular empty),
+        #     FOLLOW(A) in FOLLOW(B).  These contribution edges only
+        #     depend on the grammar, so build them once and propagate
+        #     with a worklist instead of re-sweeping every rule until
+        #     nothing changes; cycles simply re-enqueue their members
+        #     until the sets stop growing.
+        #     (The old sweep also carried a long-standing indentation
+        #     bug that lost part of FOLLOW for nullable suffixes.)
+        edges = {}
+        for s in self.nonterminals:
+            targets = set()
+            for i in self.ntr[s]:
+                r = rules[i][1]
+                for k in range(len(r)):
+                    if r[k] in nts_set and suffix_first_of(i, k + 1)[1]:
+                        targets.add(r[k])
+            if targets:
+                edges[s] = targets
+        work = list(edges)
+        while work:
+            s = work.pop()
+            fs = follow.get(s)
+            if not fs:
+                continue
+            for t in edges[s]:
+                ft = follow[t]
+                before = len(ft)
+                ft |= fs
+                if len(ft) != before and t in edges and t != s:
+                    work.append(t)
+        """ the sets are complete now; freeze them so the per-state
+        reduce loops iterate immutable hashed containers """
+        for s in list(follow):
+            follow[s] = frozenset(follow[s])
 
     def TransClose(self):
         """For each nonterminal C{s} determines the set of nonterminals
@@ -550,71 +691,100 @@ class CFGrammar:
             if s in self.ntr and s not in self.close_nt:
                 self.TRAVERSE(s, 1)
 
-    def TRAVERSE(self, s, d):
-        """ """
-        self.ms.push(s)
-        self.nd[s] = d
-        """ calculating F1(s)"""
-        self.close_nt[s] = {s: osets.Set([[]])}
+    def _trav_deps(self, s):
+        """Nonterminal dependencies of C{s} for L{TRAVERSE}, with the
+        C{(FIRST, nullable)} of the rhs suffix after each one"""
+        deps = []
         for i in self.ntr[s]:
-            if not self.rules[i][1]:
+            r = self.rules[i][1]
+            if not r:
                 continue
-            else:
-                r = self.rules[i][1]
-                for j in range(len(r)):
-                    if r[j+1:]:
-                        f = self.FIRST(r[j+1:])
-                        ns = self.nullable[" ".join(r[j+1:])]
-                    else:
-                        f = []
-                        ns = 1
-                    if r[j] in self.nonterminals:
-                        if r[j] not in self.close_nt[s]:
-                            self.close_nt[s][r[j]] = osets.Set([[]])
-                        if r[j+1:]:
-                            self.close_nt[s][r[j]].append((f, ns))
-                        if not self.nullable[r[j]]:
-                            break
-                    else:
+            for j in range(len(r)):
+                if r[j] in self.nonterminals_set:
+                    deps.append((r[j],) + self._suffix_first_of(i, j + 1))
+                    if not self.nullable[r[j]]:
                         break
-        """reflexive transitive closure"""
-        for i in self.ntr[s]:
-            if not self.rules[i][1]:
-                continue
-            else:
-                r = self.rules[i][1]
-                for j in range(len(r)):
-                    f = self.FIRST(r[j+1:])
-                    ns = self.nullable[" ".join(r[j+1:])]
-                    if r[j] in self.nonterminals:
-                        if r[j] not in self.close_nt:
-                            self.TRAVERSE(r[j], d+1)
-                        if r[j] in self.nd and self.nd[r[j]] != -1:
-                            self.nd[s] = min(self.nd[s], self.nd[r[j]])
-                        for k in list(self.close_nt[r[j]]):
-                            if k not in self.close_nt[s]:
-                                self.close_nt[s][k] = osets.Set([[]])
+                else:
+                    break
+        return deps
+
+    def TRAVERSE(self, s, d):
+        """Iterative, with the same explicit-frame-stack scheme as
+        L{FIRST_TRA}"""
+        close_nt = self.close_nt
+        nd = self.nd
+        nullable = self.nullable
+        nts_set = self.nonterminals_set
+        work = [[s, d, None, None]]
+        while work:
+            frame = work[-1]
+            s, d = frame[0], frame[1]
+            if frame[2] is None:
+                self.ms.push(s)
+                nd[s] = d
+                """ calculating F1(s)"""
+                close_nt[s] = {s: osets.Set([[]])}
+                for i in self.ntr[s]:
+                    if not self.rules[i][1]:
+                        continue
+                    else:
+                        r = self.rules[i][1]
+                        for j in range(len(r)):
+                            f, ns = self._suffix_first_of(i, j + 1)
+                            if r[j] in nts_set:
+                                if r[j] not in close_nt[s]:
+                                    close_nt[s][r[j]] = osets.Set([[]])
+                                if r[j+1:]:
+                                    close_nt[s][r[j]].append((f, ns))
+                                if not nullable[r[j]]:
+                                    break
                             else:
-                                for v in self.close_nt[s][k]:
-                                    if not v:
-                                        self.close_nt[s][k].append((f, ns))
-                                    else:
-                                        p, n = v
-                                        if n:
-                                            self.close_nt[s][k].append((p+f, ns))
-                                        else:
-                                            self.close_nt[s][k].append((p, n))
-                        if not self.nullable[r[j]]:
-                            break
+                                break
+                frame[2] = iter(self._trav_deps(s))
+            """reflexive transitive closure"""
+            it = frame[2]
+            dep = frame[3]
+            frame[3] = None
+            descend = False
+            while True:
+                if dep is None:
+                    dep = next(it, None)
+                    if dep is None:
+                        break
+                    if dep[0] not in close_nt:
+                        """ the recursive call: push a frame and redo
+                        the dependency once it is resolved """
+                        frame[3] = dep
+                        work.append([dep[0], d+1, None, None])
+                        descend = True
+                        break
+                y, f, ns = dep
+                if y in nd and nd[y] != -1:
+                    nd[s] = min(nd[s], nd[y])
+                for k in list(close_nt[y]):
+                    if k not in close_nt[s]:
+                        close_nt[s][k] = osets.Set([[]])
                     else:
+                        for v in close_nt[s][k]:
+                            if not v:
+                                close_nt[s][k].append((f, ns))
+                            else:
+                                p, n = v
+                                if n:
+                                    close_nt[s][k].append((p | f, ns))
+                                else:
+                                    close_nt[s][k].append((p, n))
+                dep = None
+            if descend:
+                continue
+            if nd[s] == d:
+                while 1:
+                    y = self.ms.pop()
+                    if y == s:
                         break
-        if self.nd[s] == d:
-            while 1:
-                y = self.ms.pop()
-                if y == s:
-                    break
-                self.close_nt[y] = self.close_nt[s].copy()
-                self.nd[y] = -1
+                    close_nt[y] = close_nt[s].copy()
+                    nd[y] = -1
+            work.pop()
 
     def DERIVE_NT(self):
         """For each nonterminal C{s} determines the set of nonterminals
@@ -636,17 +806,16 @@ class CFGrammar:
             else:
                 r = self.rules[i][1]
                 for j in range(len(r)):
-                    if r[j] in self.nonterminals:
+                    if r[j] in self.nonterminals_set:
                         if r[j] not in self.derive_nt:
                             self.DERIVE_ONE_NT(r[j])
+                        suffix = r[j+1:]
                         for k in list(self.derive_nt[r[j]]):
                             if k not in self.derive_nt[s]:
                                 self.derive_nt[s][k] = osets.Set([])
-                            for p in self.derive_nt[r[j]][k]:
-                                if not p:
-                                    self.derive_nt[s][k].append(r[j+1:])
-                                else:
-                                    self.derive_nt[s][k].append(r[j+1:].append(p))
+                            self.derive_nt[s][k].s_extend(
+                                [suffix if not p else suffix + p
+                                 for p in self.derive_nt[r[j]][k]])
                         if not self.nullable[r[j]]:
                             break
                     else:
@@ -656,7 +825,7 @@ class CFGrammar:
         """ """
         self.derive_ter = {}
         for s in self.terminals:
-            self.derive_ter[s] = osets.Set([s])
+            self.derive_ter[s] = {s}
         e = 1
         while e:
             e = 0
@@ -666,31 +835,35 @@ class CFGrammar:
                     if r == []:
                         continue
                     for i in range(len(r)):
-                        if r[i] in self.terminals:
+                        if r[i] in self.terminals_set:
                             if i < len(r) - 1:
                                 if r[i+1] in self.derive_ter:
-                                    if s not in self.derive_ter:
-                                        self.derive_ter[s] = osets.Set([])
-                                    if self.derive_ter[s].s_append(r[i]):
+                                    d = self.derive_ter.setdefault(s, set())
+                                    if r[i] not in d:
+                                        d.add(r[i])
                                         e = 1
                                 break
                             else:
-                                if s not in self.derive_ter:
-                                    self.derive_ter[s] = osets.Set([])
-                                if self.derive_ter[s].s_append(r[i]):
+                                d = self.derive_ter.setdefault(s, set())
+                                if r[i] not in d:
+                                    d.add(r[i])
                                     e = 1
                                 break
                         else:
                             """ non-terminal"""
                             if r[i] in self.derive_ter:
-                                if s not in self.derive_ter:
-                                    self.derive_ter[s] = osets.Set([])
-                                if self.derive_ter[s].s_extend(self.derive_ter[r[i]]) == 1:
+                                d = self.derive_ter.setdefault(s, set())
+                                before = len(d)
+                                d |= self.derive_ter[r[i]]
+                                if len(d) != before:
                                     e = 1
                             if i > 0 and self.nullable[r[i]]:
                                 continue
                             else:
                                 break
+        """ freeze once complete; make_action_goto only iterates them """
+        for s in list(self.derive_ter):
+            self.derive_ter[s] = frozenset(self.derive_ter[s])
 
 
 class LRtable:
@@ -700,7 +873,15 @@ class LRtable:
         @ivar operators: operators
         @ivar  Log: Log report for LR table construction
 
+        @cvar _table_cache: process-wide cache of built tables, keyed
+        by L{_table_key}; repeated construction for the same grammar
+        (e.g. several parsers over one grammar in a session) reuses
+        the ACTION/GOTO dictionaries instead of rebuilding them
+
     """
+
+    _table_cache = {}
+
     def __init__(self, cfgr, operators=None, noconflicts=1, expect=0):
         """
         @param cfgr: a context-free grammar
@@ -713,12 +894,44 @@ class LRtable:
         """
         self.gr = cfgr
         self.gr.makeFFN()
+        """ dot-position maps built once per table: the symbol right
+        after the dot (or "") and the rhs suffix beyond it, for every
+        (rule, position) pair """
+        self.next_sym = next_sym = {}
+        self.rhs_after = rhs_after = {}
+        for n in range(len(cfgr.rules)):
+            rhs = cfgr.rules[n][1]
+            for i in range(len(rhs)):
+                next_sym[(n, i)] = rhs[i]
+                rhs_after[(n, i)] = tuple(rhs[i + 1:])
+            next_sym[(n, len(rhs))] = ""
+            rhs_after[(n, len(rhs))] = ()
         self.operators = operators
         self.precedence = None
 #        if self.operators:
         self.rules_precedence()
+        key = self._table_key(cfgr, operators, noconflicts, expect)
+        cached = self._table_cache.get(key)
+        if cached is not None:
+            self.ACTION, self.GOTO, self.precedence, self.Log = cached
+            return
         self.Log = LogLR(noconflicts, expect)
         self.make_action_goto()
+        self._table_cache[key] = (self.ACTION, self.GOTO,
+                                  self.precedence, self.Log)
+
+    def NextToDot(self, item):
+        """ returns symbol next to the dot or empty string"""
+        return self.next_sym[(item[0], item[1])]
+
+    def _table_key(self, cfgr, operators, noconflicts, expect):
+        """Fingerprint of everything the table depends on: the
+        productions (semantic actions do not matter), the operator
+        precedences and the conflict policy"""
+        rules = tuple((r[0], tuple(r[1]), r[3] if len(r) == 4 else None)
+                      for r in cfgr.rules)
+        ops = tuple(sorted(operators.items())) if operators else None
+        return (self.__class__.__name__, rules, ops, noconflicts, expect)
 
     def make_action_goto(self):
         """ make C{action[i, X]} and C{goto[i, X]}
@@ -730,49 +943,75 @@ class LRtable:
         self.GOTO = {}
         # shelve not working with osets
         # self.Log.items = c
+        """ canonical item-set -> state number, so state lookups are a
+        hash probe instead of a linear scan of c """
+        state_index = {}
         for i in range(len(c)):
+            state_index[frozenset(c[i])] = i
+        """ items sharing a next-symbol ask for the same goto; compute
+        it only once per (state, symbol) """
+        goto_cache = {}
+
+        def goto_cached(i, x):
+            k = (i, x)
+            v = goto_cache.get(k)
+            if v is None:
+                v = goto_cache[k] = self.goto(c[i], x)
+            return v
+
+        NextToDot = self.NextToDot
+        add_action = self.add_action
+        terminals_set = self.gr.terminals_set
+        rules = self.gr.rules
+        for i in range(len(c)):
+            """ bucket the items of the state by their next-symbol:
+            items sharing it yield one and the same shift action """
+            next_syms = []
+            at_end = []
             for item in c[i]:
-                a = self.NextToDot(item)
-                if a in self.gr.terminals:
-                    state = self.goto(c[i], a)
-                    try:
-                        j = c.index(state)
-                        self.add_action(i, a, 'shift', j)
-                    except IndexError:
-                        if _DEBUG:
-                            print("no state")
-                elif a == "":
-                    """ Dot at right end """
-                    l = self.gr.rules[item[0]][0]
-                    if l != self.gr.aug_start:
-                        self.dotatend(item, i)
-                    else:
-                        """ last rule """
-                        self.add_action(i, self.gr.endmark, 'accept', [])
+                a = NextToDot(item)
+                if a == "":
+                    at_end.append(item)
+                elif a not in next_syms:
+                    next_syms.append(a)
+            for a in next_syms:
+                if a in terminals_set:
+                    state = goto_cached(i, a)
+                    j = state_index.get(frozenset(state))
+                    if j is not None:
+                        add_action(i, a, 'shift', j)
+                    elif _DEBUG:
+                        print("no state")
+            for item in at_end:
+                """ Dot at right end """
+                l = rules[item[0]][0]
+                if l != self.gr.aug_start:
+                    self.dotatend(item, i)
+                else:
+                    """ last rule """
+                    add_action(i, self.gr.endmark, 'accept', [])
             for s in self.gr.nonterminals:
-                state = self.goto(c[i], s)
-                try:
-                    j = c.index(state)
+                state = goto_cached(i, s)
+                j = state_index.get(frozenset(state))
+                if j is not None:
                     self.GOTO[(i, s)] = j
-                except ValueError:
-                    pass
 
     def rules_precedence(self):
         """Rule precedence obtained as the precedence of the right
         most terminal. """
         self.precedence = {}
+        operators = self.operators
         for i in range(len(self.gr.rules)):
             if len(self.gr.rules[i]) == 4:
                 self.precedence[i] = self.gr.rules[i][3]
             else:
                 self.precedence[i] = None
-                if self.operators:
-                    self.gr.rules[i][1].reverse()
-                    for s in self.gr.rules[i][1]:
-                        if s in self.operators:
-                            self.precedence[i] = self.operators[s]
+                if operators:
+                    rhs = self.gr.rules[i][1]
+                    for k in range(len(rhs)-1, -1, -1):
+                        if rhs[k] in operators:
+                            self.precedence[i] = operators[rhs[k]]
                             break
-                    self.gr.rules[i][1].reverse()
 
         if _DEBUG:
             print("Precedence %s" % self.precedence)
@@ -785,27 +1024,29 @@ class LRtable:
         try to use it; otherwise conflict is resolved in favor of shift
            - reduce/reduce: choosing the production rule listed first
         """
-        if (i, a) in self.ACTION and self.ACTION[(i, a)] != (action, j):
-            action1, j1 = self.ACTION[(i, a)]
-            if _DEBUG:
-                print("LR conflict %s %s %s %s %s %s" %
-                      (action, j, action1, j1, i, a))
-            if action1 == 'shift' and action == 'reduce':
-                self.resolve_shift_reduce(i, a, j1, j)
-            elif action == 'shift' and action1 == 'reduce':
-                self.resolve_shift_reduce(i, a, j, j1)
-            elif action == 'reduce' and action1 == 'reduce':
-                if self.Log.noconflicts:
-                    # RESOLVED by choosing first rule
-                    if j > j1:
-                        self.ACTION[(i, a)] = (action, j1)
-                    else:
-                        self.ACTION[(i, a)] = (action, j)
-                    self.Log.add_conflict('rr', i, a, j1, j)
-                else:
-                    raise LRConflictError(i, a)
-        else:
+        cur = self.ACTION.get((i, a))
+        if cur is None or cur == (action, j):
+            """ hot path: no conflict """
             self.ACTION[(i, a)] = (action, j)
+            return
+        action1, j1 = cur
+        if _DEBUG:
+            print("LR conflict %s %s %s %s %s %s" %
+                  (action, j, action1, j1, i, a))
+        if action1 == 'shift' and action == 'reduce':
+            self.resolve_shift_reduce(i, a, j1, j)
+        elif action == 'shift' and action1 == 'reduce':
+            self.resolve_shift_reduce(i, a, j, j1)
+        elif action == 'reduce' and action1 == 'reduce':
+            if self.Log.noconflicts:
+                # RESOLVED by choosing first rule
+                if j > j1:
+                    self.ACTION[(i, a)] = (action, j1)
+                else:
+                    self.ACTION[(i, a)] = (action, j)
+                self.Log.add_conflict('rr', i, a, j1, j)
+            else:
+                raise LRConflictError(i, a)
 
     def resolve_shift_reduce(self, i, a, s, r):
         """Operators precedence resolution or standard option: shift
@@ -854,9 +1095,9 @@ class SLRtable(LRtable):
 
     def dotatend(self, item, i):
         n, k = item
-        l = self.gr.rules[item[0]][0]
-        for a in self.gr.follow[l]:
-            self.add_action(i, a, 'reduce', n)
+        add_action = self.add_action
+        for a in self.gr.follow[self.gr.rules[n][0]]:
+            add_action(i, a, 'reduce', n)
 
     def closure(self, items):
         """The closure of a set of C{LR(0)} items C{I} is the set of
@@ -865,34 +1106,57 @@ class SLRtable(LRtable):
            - If A -> s.Bt in closure(I) and B -> r,
              then add B ->.r to closure(I)
         (aho86:_compil page 223)
+
+        Results are memoized by the kernel (a frozenset of items),
+        which recurs heavily across goto calls; the returned list is
+        shared and must not be mutated.
         """
+        try:
+            memo = self._closure_memo
+        except AttributeError:
+            memo = self._closure_memo = {}
+        kernel = frozenset(items)
+        cached = memo.get(kernel)
+        if cached is not None:
+            return cached
         added = {}
-        for l in self.gr.nonterminals:
-            added[l] = 0
+        ntr = self.gr.ntr
         close = items[:]
-        e = 1
-        while e:
-            e = 0
-            for i in close:
-                s = self.NextToDot(i)
-                if (s in self.gr.nonterminals and added[s] == 0
-                        and s in self.gr.ntr):
-                    for n in self.gr.ntr[s]:
-                        close.append((n, 0))
-                    added[s] = 1
-                    e = 1
+        work = deque(close)
+        while work:
+            s = self.NextToDot(work.popleft())
+            if s in ntr and s not in added:
+                added[s] = 1
+                for n in ntr[s]:
+                    new = (n, 0)
+                    close.append(new)
+                    work.append(new)
+        memo[kernel] = close
         return close
 
     def goto(self, items, s):
         """ goto(I, X) where I is a set of items and X a grammar symbol
         is the closure of the set of all items A -> sX.r such that
-        A -> s.Xr is in I"""
+        A -> s.Xr is in I
+
+        Different states often ask for the same (item set, symbol)
+        pair, so results are cached; items() clears the cache when the
+        collection is complete."""
+        try:
+            cache = self._goto_cache
+        except AttributeError:
+            cache = self._goto_cache = {}
+        key = (frozenset(items), s)
+        hit = cache.get(key)
+        if hit is not None:
+            return hit
         valid = osets.Set([])
         for item in items:
             if self.NextToDot(item) == s:
                 n, i = item
                 valid.append((n, i + 1))
-        return self.closure(valid)
+        res = cache[key] = self.closure(valid)
+        return res
 
     def items(self):
         """ An LR(0) item of a grammar G is a production of G with a dot at
@@ -905,53 +1169,93 @@ class SLRtable(LRtable):
         # CGO this is why changing the order of the extra rule does not work
         # CGO Initialization of Set(0)
         c = osets.Set([self.closure(osets.Set([(len(self.gr.rules) - 1, 0)]))])
+        # CGO dedup through a frozenset index instead of scanning c
+        index = {frozenset(c[0]): 0}
         symbols = self.gr.terminals + self.gr.nonterminals
         # CGO I will add this in the future: symbols = self.getSymbols()
+        next_sym = self.next_sym
         e = 1  # CGO newSetOfItemsAdded=True
         while e:  # CGO while newSetOfItemsAdded:
             e = 0  # CGO newSetOfItemsAdded=False
             for i in c:
+                """ only the symbols right after a dot can yield a
+                nonempty goto; skip the rest """
+                sset = {next_sym[k] for k in i}
                 for s in symbols:
+                    if s not in sset:
+                        continue
                     valid = self.goto(i, s)
-                    if valid != [] and valid not in c:
-                        c.append(valid)
-                        e = 1  # CGO newSetOfItemsAdded=True
+                    if valid:
+                        h = frozenset(valid)
+                        if h not in index:
+                            index[h] = len(c)
+                            c.members.append(valid)
+                            e = 1  # CGO newSetOfItemsAdded=True
+        self._goto_cache.clear()
         return c
 
     def print_items(self, c):
         """Print SLR items """
-        s = ""
+        parts = []
         j = 0
         for i in c:
-            s = s + "I_%d: \n" % j
+            parts.append("I_%d: \n" % j)
             for item in i:
                 r, p = item
                 lhs = self.gr.rules[r][0]
                 rhs = self.gr.rules[r][1]
-                s = s + ("\t %s -> %s . %s \n" %
-                         (lhs, " ".join(rhs[:p]),
-                          " ".join(rhs[p:])))
+                parts.append("\t %s -> %s . %s \n" %
+                             (lhs, " ".join(rhs[:p]),
+                              " ".join(rhs[p:])))
             j += 1
-        return s
-
-    def NextToDot(self, item):
-        """ returns symbol next to te dot or empty string"""
-        n, i = item
-        try:
-            s = self.gr.rules[n][1][i]
-        except IndexError:
-            s = ""
-        return s
+        return "".join(parts)
 
 
 class LR1table(LRtable):
     """
     Class for construction of a LR1 table
 
-    Items are represented by a pair of integers
-        (number of rule, position of dot)
+    Items sharing the same core C{(number of rule, position of dot)}
+    are collapsed into one entry whose value is the set of lookahead
+    terminals, so the fixed points run once per core instead of once
+    per (core, lookahead) pair.  States are deduplicated by their full
+    contents, cores and lookaheads, so the collection is still the
+    canonical C{LR(1)} one (aho86:_compil page 231).
     """
 
+    def make_action_goto(self):
+        """ make C{action[i, X]} and C{goto[i, X]}
+        All pairs C{(i, s)}  not in action and goto dictionaries are 'error'"""
+        c = self.items()
+        if _DEBUG:
+            print(self.print_items(c))
+        self.ACTION = {}
+        self.GOTO = {}
+        add_action = self.add_action
+        terminals_set = self.gr.terminals_set
+        rules = self.gr.rules
+        next_sym = self.next_sym
+        goto_ref = self._goto_ref
+        for i in range(len(c)):
+            for item, la in c[i].items():
+                a = next_sym[item]
+                if a == "":
+                    """ Dot at right end """
+                    if rules[item[0]][0] != self.gr.aug_start:
+                        for t in la:
+                            add_action(i, t, 'reduce', item[0])
+                    else:
+                        """ last rule """
+                        add_action(i, self.gr.endmark, 'accept', [])
+                elif a in terminals_set:
+                    j = goto_ref.get((i, a))
+                    if j is not None:
+                        add_action(i, a, 'shift', j)
+            for s in self.gr.nonterminals:
+                j = goto_ref.get((i, s))
+                if j is not None:
+                    self.GOTO[(i, s)] = j
+
     def closure(self, items):
         """The closure of a set of C{LR(1)} items C{I} is the set of items constructed
         from I by the two rules:
@@ -960,94 +1264,114 @@ class LR1table(LRtable):
             - If C{[A -> s.Bt, a]} in C{closure(I)}, for  C{B ->r} and
               each terminal C{b} in C{first(ta)}, add C{[B ->.r, b]}
               to C{closure(I)}
+
+        Over the collapsed representation the per-lookahead additions
+        become one set union per expanded rule.  Results are memoized
+        by the full state contents; cache hits get a fresh copy.
         """
-        close = items
-        e = 1
-        while e:
-            e = 0
-            for i in close:
-                s = self.NextToDot(i)
-                sa = self.gr.FIRST(self.AfterDot(i))
-                if s in self.gr.nonterminals and s in self.gr.ntr:
-                    for n in self.gr.ntr[s]:
-                        for b in sa:
-                           e = close.append((n, 0, b))
-        return close
+        try:
+            memo = self._closure_memo
+        except AttributeError:
+            memo = self._closure_memo = {}
+        key = tuple(sorted((k, frozenset(v)) for k, v in items.items()))
+        cached = memo.get(key)
+        if cached is not None:
+            return {k: set(v) for k, v in cached}
+        ntr = self.gr.ntr
+        nts = self.gr.nonterminals_set
+        next_sym = self.next_sym
+        suffix_first_of = self.gr._suffix_first_of
+        work = deque(items)
+        queued = set(items)
+        while work:
+            i = work.popleft()
+            queued.discard(i)
+            s = next_sym[i]
+            if s in nts and s in ntr:
+                f, ns = suffix_first_of(i[0], i[1] + 1)
+                sa = f | items[i] if ns else f
+                for n in ntr[s]:
+                    la = items.get((n, 0))
+                    if la is None:
+                        items[(n, 0)] = set(sa)
+                        grew = 1
+                    else:
+                        before = len(la)
+                        la |= sa
+                        grew = len(la) != before
+                    if grew and (n, 0) not in queued:
+                        work.append((n, 0))
+                        queued.add((n, 0))
+        memo[key] = [(k, frozenset(v)) for k, v in items.items()]
+        return items
 
     def goto(self, items, s):
         """ goto(I, X) where I is a set of items and X a grammar symbol
         is the closure of the set of all items (A -> sX.r, a) such that
         (A -> s.Xr, a) in I"""
-        valid = osets.Set([])
-        for item in items:
-            if self.NextToDot(item) == s:
-                n, i, t = item
-                valid.append((n, i + 1, t))
+        valid = {}
+        next_sym = self.next_sym
+        for k, la in items.items():
+            if next_sym[k] == s:
+                valid[(k[0], k[1] + 1)] = set(la)
         return self.closure(valid)
 
     def items(self):
-        """ An LR(1) item of a grammar G is a production of G with a dot at
-            some position of the right hand side and a terminal:
-            (rule_number, dot_position, terminal)
-            (aho86:_compil page 231)
+        """ The canonical collection over the collapsed states; every
+        computed transition is recorded in C{self._goto_ref} so
+        make_action_goto never recomputes a goto.
         """
         # CGO this is why changing the order of the extra rule does not work
         # CGO Initialization of Set(0)
-        c = osets.Set([self.closure(osets.Set([(len(self.gr.rules) - 1, 0,
-                                               self.gr.endmark)]))])
+        i0 = {(len(self.gr.rules) - 1, 0): {self.gr.endmark}}
+        c = [self.closure(i0)]
+
+        def canon(d):
+            return frozenset((k, frozenset(v)) for k, v in d.items())
+
+        # CGO dedup through a frozenset index instead of scanning c
+        index = {canon(c[0]): 0}
+        self._goto_ref = goto_ref = {}
         symbols = self.gr.terminals + self.gr.nonterminals
-        # CGO I will add this: symbols = self.getSymbols()
-        e = 1  # CGO newSetOfItemsAdded=True
-        while e:  # CGO while newSetOfItemsAdded:
-            e = 0  # CGO newSetOfItemsAdded=False
-            for i in c:
-                for s in symbols:
-                    valid = self.goto(i, s)
-                    if valid != []:
-                        if c.s_append(valid):  # CGO s_appends only adds it if not existent
-                            e = 1  # CGO newSetOfItemsAdded=True
+        next_sym = self.next_sym
+        i = 0
+        while i < len(c):
+            """ only the symbols right after a dot can yield a
+            nonempty goto; skip the rest """
+            sset = {next_sym[k] for k in c[i]}
+            for s in symbols:
+                if s not in sset:
+                    continue
+                valid = self.goto(c[i], s)
+                if valid:
+                    h = canon(valid)
+                    j = index.get(h)
+                    if j is None:
+                        j = len(c)
+                        index[h] = j
+                        c.append(valid)
+                    goto_ref[(i, s)] = j
+            i += 1
         return c
 
     def print_items(self, c):
         """Print C{LR(1)} items """
-        s = ""
+        parts = []
         j = 0
         for i in c:
-            s = s + "I_%d: \n" % j
+            parts.append("I_%d: \n" % j)
             for item in i:
-                r, p, t = item
+                r, p = item
                 lhs = self.gr.rules[r][0]
                 rhs = self.gr.rules[r][1]
-                s = s + ("\t %s -> %s . %s , %s\n" %
-                         (lhs, " ".join(rhs[:p]),
-                          " ".join(rhs[p:]), t))
+                parts.append("\t %s -> %s . %s , %s\n" %
+                             (lhs, " ".join(rhs[:p]),
+                              " ".join(rhs[p:]), sorted(i[item])))
             j += 1
+        s = "".join(parts)
         print(s)
         return s
 
-    def NextToDot(self, item):
-        """ returns symbol next to the dot or empty string"""
-        n, i, t = item
-        try:
-            s = self.gr.rules[n][1][i]
-        except IndexError:
-            s = ""
-        return s
-
-    def AfterDot(self, item):
-        """ returns symbol next to the dot or empty string"""
-        n, i, t = item
-        try:
-            s = self.gr.rules[n][1][i+1:]
-        except IndexError:
-            s = []
-        s.append(t)
-        return s
-
-    def dotatend(self, item, i):
-        n, k, t = item
-        self.add_action(i, t, 'reduce', n)
-
 
 class LALRtable1(LRtable):
     """Class for construction of C{LALR(1)} tables"""
@@ -1092,31 +1416,40 @@ class LALRtable1(LRtable):
         C{(rule_number, dot_position)} and value a set of terminals
         """
         i0 = {}
-        i0[(len(self.gr.rules) - 1, 0)] = osets.Set([self.gr.endmark])
+        i0[(len(self.gr.rules) - 1, 0)] = {self.gr.endmark}
         c = osets.Set([self.closure(i0)])
+        # CGO state lookup by item core (the key set), one hash probe
+        # CGO instead of scanning c in get_union/core_merge
+        self._core_index = {frozenset(c[0]): 0}
         symbols = self.gr.terminals + self.gr.nonterminals
+        next_sym = self.next_sym
         e = 1
         while e:
             e = 0
             for i in c:
+                """ only the symbols right after a dot can yield a
+                nonempty goto; skip the rest """
+                sset = {next_sym[k] for k in i}
                 for s in symbols:
+                    if s not in sset:
+                        continue
                     if self.core_merge(c, self.goto(i, s)) == 1:
                         e = 1
         return c
 
     def print_items(self, c):
         """Print C{LALR(1)} items """
-        s = ""
-        j = 0
+        parts = []
         for i in range(len(c)):
-                s = s + "I_%d: \n" % i
+                parts.append("I_%d: \n" % i)
                 for item in list(c[i]):
                     r, p = item
                     lhs = self.gr.rules[r][0]
                     rhs = self.gr.rules[r][1]
-                    s = s + ("\t %s -> %s . %s, %s \n" %
-                             (lhs, " ".join(rhs[:p]),
-                              " ".join(rhs[p:]), c[i][item]))
+                    parts.append("\t %s -> %s . %s, %s \n" %
+                                 (lhs, " ".join(rhs[:p]),
+                                  " ".join(rhs[p:]), c[i][item]))
+        s = "".join(parts)
         print(s)
         return s
 
@@ -1127,10 +1460,7 @@ class LALRtable1(LRtable):
         valid = {}
         for (n, i) in list(items):
             if self.NextToDot((n, i)) == s:
-                if (n, i+1) not in valid:
-                    valid[(n, i + 1)] = osets.Set([])
-                for t in items[(n, i)]:
-                    valid[(n, i + 1)].append(t)
+                valid[(n, i + 1)] = set(items[(n, i)])
         return self.closure(valid)
 
     def closure(self, items):
@@ -1139,65 +1469,79 @@ class LALRtable1(LRtable):
            - every item of I is in closure(I)
            - If [A -> s.Bt, a] in closure(I), for  B ->r and each terminal b in
              first(ta), add [B ->.r, b] to closure(I)
+
+        Results are memoized by the item cores together with their
+        lookahead sets; callers mutate the result, so cache hits get a
+        fresh copy.
         """
-        e = 1
-        while e:
-            e = 0
-            for i in list(items):
-                s = self.NextToDot(i)
-                if s in self.gr.nonterminals and s in self.gr.ntr:
-                    l = self.AfterDot(i, items)
-                    for n in self.gr.ntr[s]:
-                        if (n, 0) not in items:
-                            items[(n, 0)] = osets.Set([])
-                        if items[(n, 0)].s_extend(l) == 1:
-                            e = 1
+        try:
+            memo = self._closure_memo
+        except AttributeError:
+            memo = self._closure_memo = {}
+        key = tuple(sorted((k, frozenset(v)) for k, v in items.items()))
+        cached = memo.get(key)
+        if cached is not None:
+            return {k: set(v) for k, v in cached}
+        ntr = self.gr.ntr
+        nts = self.gr.nonterminals_set
+        work = deque(items)
+        queued = set(items)
+        while work:
+            i = work.popleft()
+            queued.discard(i)
+            s = self.NextToDot(i)
+            if s in nts and s in ntr:
+                l = self.AfterDot(i, items)
+                for n in ntr[s]:
+                    la = items.get((n, 0))
+                    grew = 0
+                    if la is None:
+                        la = items[(n, 0)] = set()
+                        grew = 1
+                    before = len(la)
+                    la |= l
+                    if len(la) != before:
+                        grew = 1
+                    if grew and (n, 0) not in queued:
+                        work.append((n, 0))
+                        queued.add((n, 0))
+        memo[key] = [(k, frozenset(v)) for k, v in items.items()]
         return items
 
     def get_union(self, c, j):
-        """ """
-        for i in c:
-            if i.keys() == j.keys():
-                return c.index(i)
-        return -1
+        """State number of the item set with the same core as C{j},
+        or -1"""
+        if not j:
+            return -1
+        return self._core_index.get(frozenset(j), -1)
 
     def core_merge(self, c, j):
-        """ """
-        if j == {} or j in c:
+        """Merge C{j} into the state sharing its core, appending a new
+        state when there is none; returns 1 when anything changed"""
+        if not j:
             return 0
-        e = 2
-        for i in c:
-            if i.keys() == j.keys():
-                e = 0
-                for k in list(j):
-                    if i[k].s_extend(j[k]) == 1:
-                        e = 1
-                break
-        if e == 2:
-            e = c.s_append(j)
+        k = self._core_index.get(frozenset(j))
+        if k is None:
+            self._core_index[frozenset(j)] = len(c)
+            c.members.append(j)
+            return 1
+        i = c[k]
+        e = 0
+        for key in list(j):
+            la = i[key]
+            before = len(la)
+            la |= j[key]
+            if len(la) != before:
+                e = 1
         return e
 
-    def NextToDot(self, item):
-        """ returns symbol next to the dot or empty string"""
-        n, i = item
-        try:
-            s = self.gr.rules[n][1][i]
-        except IndexError:
-            s = ""
-        return s
-
     def AfterDot(self, item, items):
         """returns FIRST of strings after the dot concatenated with lookahead"""
         n, i = item
-        try:
-            s = self.gr.rules[n][1][i+1:]
-        except IndexError:
-            s = []
-        sa = osets.Set([])
-        for a in items[item]:
-            s.append(a)
-            sa.s_extend(self.gr.FIRST(s))
-            del s[len(s)-1]
+        f, ns = self.gr._suffix_first_of(n, i + 1)
+        sa = set(f)
+        if ns:
+            sa.update(items[item])
         return sa
 
     def dotatend(self, item, c, i):
@@ -1222,29 +1566,45 @@ class LALRtable(LALRtable1):
         self.GOTO = {}
         # shelve not working with osets
         # self.Log.items = c
+        """ per-nonterminal buckets of the empty-rule reductions
+        reachable through close_nt, lifted out of the state loop """
+        ntr = self.gr.ntr
+        rules = self.gr.rules
+        empty_red = {}
+        for C in self.gr.close_nt:
+            bucket = []
+            for A in list(self.gr.close_nt[C]):
+                """Error: ignores end string s in C->*As"""
+                ks = [k for k in ntr.get(A, ())
+                      if rules[k][1] == []]
+                if ks:
+                    for p in self.gr.close_nt[C][A]:
+                        bucket.append((p, ks))
+            if bucket:
+                empty_red[C] = bucket
+        NextToDot = self.NextToDot
+        add_action = self.add_action
+        goto_ref = self.goto_ref
+        derive_ter = self.gr.derive_ter
+        nonterminals_set = self.gr.nonterminals_set
+        terminals_set = self.gr.terminals_set
         for i in range(len(c)):
             for item in list(c[i]):
-                C = self.NextToDot(item)
-                if C in self.gr.nonterminals:
-                    if C in self.gr.derive_ter:
-                        for a in self.gr.derive_ter[C]:
-                            if (i, a) in self.goto_ref:
-                                j = self.goto_ref[(i, a)]
-                                self.add_action(i, a, 'shift', j)
-                    if C in self.gr.close_nt:
-                        for A in list(self.gr.close_nt[C]):
-                            """Error: ignores end string s in C->*As"""
-                            for p in self.gr.close_nt[C][A]:
-                                r = self.AfterDotTer(item, c[i], p)
-                                if A in self.gr.ntr:
-                                    for k in self.gr.ntr[A]:
-                                        if self.gr.rules[k][1] == []:
-                                            for a in r:
-                                                self.add_action(i, a, 'reduce', k)
-                elif C in self.gr.terminals:
-                    if (i, C) in self.goto_ref:
-                        j = self.goto_ref[(i, C)]
-                        self.add_action(i, C, 'shift', j)
+                C = NextToDot(item)
+                if C in nonterminals_set:
+                    if C in derive_ter:
+                        for a in derive_ter[C]:
+                            if (i, a) in goto_ref:
+                                add_action(i, a, 'shift',
+                                           goto_ref[(i, a)])
+                    for (p, ks) in empty_red.get(C, ()):
+                        r = self.AfterDotTer(item, c[i], p)
+                        for k in ks:
+                            for a in r:
+                                add_action(i, a, 'reduce', k)
+                elif C in terminals_set:
+                    if (i, C) in goto_ref:
+                        add_action(i, C, 'shift', goto_ref[(i, C)])
                 else:
                     """ Dot at right end """
                     l = self.gr.rules[item[0]][0]
@@ -1267,83 +1627,127 @@ class LALRtable(LALRtable1):
         C{(rule_number, dot_position)} and value a set of terminals.
         """
         i0 = {}
-        i0[(len(self.gr.rules) - 1, 0)] = osets.Set([self.gr.endmark])
+        i0[(len(self.gr.rules) - 1, 0)] = {self.gr.endmark}
         c = osets.Set([i0])
         symbols = self.gr.terminals + self.gr.nonterminals
-        """ kernel LR(0) items """
+        """ kernel LR(0) items; during this phase the generated
+        lookahead sets are still empty, so the core (the key set)
+        identifies a state and a frozenset index replaces the scans of
+        c """
+        core_index = self._core_index = {frozenset(i0): 0}
         self.goto_ref = {}
+        next_sym = self.next_sym
+        close_nt = self.gr.close_nt
+        ntr = self.gr.ntr
+        rules = self.gr.rules
         e = 1
         while e:
             e = 0
+            ni = 0
             for i in c:
+                """ only the symbols right after a dot, or starting a
+                rule of a nonterminal derivable from one, can yield a
+                nonempty goto; skip the rest """
+                sset = set()
+                for k0 in i:
+                    x = next_sym[k0]
+                    if x:
+                        sset.add(x)
+                    if x in close_nt:
+                        for a in list(close_nt[x]):
+                            if a in ntr:
+                                for k1 in ntr[a]:
+                                    if rules[k1][1]:
+                                        sset.add(rules[k1][1][0])
                 for s in symbols:
+                    if s not in sset:
+                        continue
                     valid = self.goto(i, s)
                     if valid != {}:
-                        if c.s_append(valid):
+                        h = frozenset(valid)
+                        j = core_index.get(h)
+                        if j is None:
+                            j = len(c)
+                            core_index[h] = j
+                            c.members.append(valid)
                             e = 1
-                        self.goto_ref[(c.index(i), s)] = c.index(valid)
+                        self.goto_ref[(ni, s)] = j
+                ni += 1
 
         """ Discovering propagated and spontaneous lookaheads for
         kernel items k and grammar symbol s"""
         lh = {}
-        for k in c:
-            nk = c.index(k)
-            lh[nk] = {}  # osets.Set([])
+        for nk in range(len(c)):
+            k = c[nk]
+            lh[nk] = {}
             for (n, i) in list(k):
-                lh[nk][(n, i)] = osets.Set([])
+                lh[nk][(n, i)] = set()
                 j = {}
-                j[(n, i)] = osets.Set([(self.gr.dummy)])
+                j[(n, i)] = {self.gr.dummy}
                 j = self.closure(j)
                 for s in symbols:
                     for (m1, j1) in list(j):
                         if self.NextToDot((m1, j1)) == s:
                             for a in j[(m1, j1)]:
                                 if a == self.gr.dummy:
-                                    lh[nk][(n, i)].append((self.goto_ref[(nk, s)], m1, j1+1))
+                                    lh[nk][(n, i)].add((self.goto_ref[(nk, s)], m1, j1+1))
                                 else:
-                                    c[self.goto_ref[(nk, s)]][(m1, j1+1)].append(a)
+                                    c[self.goto_ref[(nk, s)]][(m1, j1+1)].add(a)
                 del j
-        """ Propagate lookaheads """
-#        c[0][(len(self.gr.rules) - 1, 0)].s_append(self.gr.endmark)
-        e = 1
-        while e:
-            e = 0
-            for k in c:
-                nk = c.index(k)
-                for (n, i) in list(k):
-                    for (m, n1, i1) in lh[nk][(n, i)]:
-                        if c[m][(n1, i1)].s_extend(k[(n, i)]) == 1:
-                            e = 1
+        """ Propagate lookaheads, from a worklist of the kernel items
+        whose sets actually grew instead of re-sweeping every state """
+        work = deque()
+        queued = set()
+        for nk in range(len(c)):
+            for key in c[nk]:
+                if c[nk][key]:
+                    work.append((nk, key))
+                    queued.add((nk, key))
+        while work:
+            nk, key = work.popleft()
+            queued.discard((nk, key))
+            la = c[nk][key]
+            for (m, n1, i1) in lh[nk][key]:
+                dst = c[m][(n1, i1)]
+                before = len(dst)
+                dst |= la
+                if len(dst) != before and (m, (n1, i1)) not in queued:
+                    work.append((m, (n1, i1)))
+                    queued.add((m, (n1, i1)))
+        self._goto_cache.clear()
         return c
 
     def goto(self, items, s):
         """ C{goto(I, X)} where I is a set of kernel items and X a
             grammar symbol is the closure of the set of all items (A
-            -> sX.r, a) such that (A -> s.Xr, a) is in I"""
+            -> sX.r, a) such that (A -> s.Xr, a) is in I
+
+        The result only depends on the item cores (the lookahead sets
+        come out empty), so it is cached by (cores, symbol); items()
+        clears the cache when the collection is complete."""
+        try:
+            cache = self._goto_cache
+        except AttributeError:
+            cache = self._goto_cache = {}
+        key = (frozenset(items), s)
+        hit = cache.get(key)
+        if hit is not None:
+            return {k: set() for k in hit}
         valid = {}
         for (n, i) in list(items):
             x = self.NextToDot((n, i))
             if x == s:
-                if (n, i+1) not in valid:
-                    valid[(n, i + 1)] = osets.Set([])
+                valid.setdefault((n, i + 1), set())
             if x in self.gr.close_nt:
                 for a in list(self.gr.close_nt[x]):
                     if a in self.gr.ntr:
                         for k in self.gr.ntr[a]:
                             if (self.gr.rules[k][1] != []
                                     and self.gr.rules[k][1][0] == s):
-                                valid[(k, 1)] = osets.Set([])
+                                valid[(k, 1)] = set()
+        cache[key] = tuple(valid)
         return valid
 
-    def NextToDot(self, item):
-        """ returns symbol next to the dot or empty string"""
-        n, i = item
-        try:
-            s = self.gr.rules[n][1][i]
-        except IndexError:
-            s = ""
-        return s
-
     def AfterDotTer(self, item, items, path):
         """ returns FIRST of strings after the dot
         concatenated with lookahead"""
@@ -1353,12 +1757,7 @@ class LALRtable(LALRtable1):
             if not n:
                 return p
         l, i = item
-        try:
-            f = self.gr.FIRST(self.gr.rules[l][1][i+1:])
-            ns = self.gr.nullable[" ".join(self.gr.rules[l][1][i+1:])]
-        except IndexError:
-            f = []
-            ns = 1
+        f, ns = self.gr._suffix_first_of(l, i + 1)
         if ns:
             return items[item]
         else:
@@ -1386,6 +1785,11 @@ class LogLR:
             self.conflicts[type] = [(i, a, value1, value2)]
 
 
+_pg_cache = {}
+"""shared Yappy_grammar instances for L{LRparser.parse_grammar},
+keyed by their construction arguments"""
+
+
 class LRparser:
     """Class for LR parser
 
@@ -1437,101 +1841,212 @@ class LRparser:
 
         self.cfgr = CFGrammar(grammar)
         self.rules = self.cfgr.rules
+        """ per-rule (lhs, rhs length, semantic action), so the reduce
+        branch reads one tuple instead of re-indexing the rule """
+        self._rule_info = [(r[0], len(r[1]), r[2] if len(r) > 2 else None)
+                           for r in self.rules]
         self.terminals = self.cfgr.terminals
         self.nonterminals = self.cfgr.nonterminals
         self.endmark = self.cfgr.endmark
-        if 'nosemrules' in args:
-            self.nosemrules = args['nosemrules']
-        else:
-            self.nosemrules = 0
-        db = dbm.whichdb(table_shelve)
-        # CGO FIXME - it would be interesting to check that the pre-existent
-        #             action and goto tables are for the current grammar.
-        if not(db is None or db == "" or no_table == 0):
+        self.nosemrules = args.get('nosemrules', 0)
+        """ the saved table carries a digest of the grammar it was
+        built from, so a table file left over from another grammar is
+        rebuilt instead of silently misparsing (the old CGO FIXME) """
+        ghash = hashlib.blake2b(
+            repr([(r[0], tuple(r[1])) for r in self.rules]).encode()
+        ).hexdigest()
+        loaded = 0
+        if os.path.exists(table_shelve) and no_table != 0:
             try:
-                d = shelve.open(table_shelve, 'w')
-                self.ACTION = d['action']
-                self.GOTO = d['goto']
-                if 'version' in d:
-                    if d['version'] < _Version:
-                        raise TableError(table_shelve)
-                try:
-                    self.Log = d['log']
-                except KeyError:
+                """ one flat pickle blob instead of a shelve: a single
+                load call, no per-key pickling or dbm bookkeeping """
+                with open(table_shelve, 'rb') as d:
+                    version, gh, symbols, action, goto, log = pickle.load(d)
+                if version < _Version or gh != ghash:
                     raise TableError(table_shelve)
-                d.close()
+                self.ACTION = self._unpack_table(action, symbols)
+                self.GOTO = self._unpack_table(goto, symbols)
+                self.Log = log
+                self._pack_action_goto()
+                loaded = 1
             except Exception:
+                """ stale or corrupt table file: drop it and rebuild """
                 if os.access(table_shelve, os.W_OK):
                     os.remove(table_shelve)
                 else:
                     raise TableError(table_shelve)
-        else:
-            d = shelve.open(table_shelve, 'n')
+        if not loaded:
             self.table = tabletype(self.cfgr, operators, noconflicts, expect)
-            d['version'] = _Version
-            d['action'] = self.ACTION = self.table.ACTION
-            d['goto'] = self.GOTO = self.table.GOTO
-            d['log'] = self.Log = self.table.Log
-            d.close()
+            self.ACTION = self.table.ACTION
+            self.GOTO = self.table.GOTO
+            symbols = self.terminals + self.nonterminals
+            sym_id = {}
+            for k in range(len(symbols)):
+                sym_id[symbols[k]] = k
+            self.Log = self.table.Log
+            with open(table_shelve, 'wb') as d:
+                pickle.dump((_Version, ghash, symbols,
+                             self._pack_table(self.ACTION, sym_id),
+                             self._pack_table(self.GOTO, sym_id),
+                             self.Log), d, pickle.HIGHEST_PROTOCOL)
+            self._pack_action_goto()
+
+    def _pack_action_goto(self):
+        """Flattens ACTION/GOTO into contiguous arrays indexed by
+        C{state * n_sym + symbol id}: the parse loop then replaces the
+        tuple-keyed dict probes with one multiply-add and an array
+        load.  Tags are 0 error, 1 shift, 2 reduce, 3 accept; the
+        dictionaries are kept for printing and persistence."""
+        symbols = self.terminals + self.nonterminals
+        sym_id = self._sym_id = {}
+        for k in range(len(symbols)):
+            sym_id[symbols[k]] = k
+        n_sym = self._n_sym = len(symbols)
+        n_states = 0
+        for (i, a), v in self.ACTION.items():
+            if i >= n_states:
+                n_states = i + 1
+            if v[0] == 'shift' and v[1] >= n_states:
+                n_states = v[1] + 1
+        for (i, a), j in self.GOTO.items():
+            n_states = max(n_states, i + 1, j + 1)
+        tags = {'shift': 1, 'reduce': 2, 'accept': 3}
+        self._action_tag = atag = bytearray(n_states * n_sym)
+        self._action_arg = aarg = array('i', [0]) * (n_states * n_sym)
+        self._goto_arr = garr = array('i', [-1]) * (n_states * n_sym)
+        for (i, a), (act, j) in self.ACTION.items():
+            idx = i * n_sym + sym_id[a]
+            atag[idx] = tags[act]
+            if act != 'accept':
+                aarg[idx] = j
+        for (i, a), j in self.GOTO.items():
+            garr[i * n_sym + sym_id[a]] = j
+        """ symbol id of each rule's lhs, for the goto after a reduce """
+        self._lhs_id = array('i', [sym_id[r[0]] for r in self.rules])
+        """ reduce-cascade folding: when, for a fixed lookahead, a
+        reduce provably lands in a state whose action is again a
+        reduce, the whole cascade is stored as one action (tag 4) so
+        the parse loop dispatches once per cascade instead of once per
+        rule.  The state uncovered by popping a RHS is approximated by
+        walking the shift/goto edges backwards; since the goto itself
+        is still replayed from the real stack at parse time, a cascade
+        is folded as long as every possible successor state agrees on
+        the next reduce rule, so the folded run applies exactly the
+        rules the plain loop would """
+        pred = {}
+        for (i, a), v in self.ACTION.items():
+            if v[0] == 'shift':
+                pred.setdefault(v[1], set()).add(i)
+        for (i, a), j in self.GOTO.items():
+            pred.setdefault(j, set()).add(i)
+        rule_len = [len(r[1]) for r in self.rules]
+
+        def uncovered(s, k):
+            back = {s}
+            while k and back:
+                back = set().union(*[pred.get(u, set()) for u in back])
+                k = k - 1
+            return back
+
+        chains = []
+        chain_index = {}
+        for (s, a), v in self.ACTION.items():
+            if v[0] != 'reduce':
+                continue
+            n = v[1]
+            chain = [n]
+            cur = {s}
+            while len(chain) < 16:
+                back = set()
+                for u in cur:
+                    back |= uncovered(u, rule_len[n])
+                targets = {self.GOTO.get((u, self.rules[n][0]))
+                           for u in back}
+                if None in targets:
+                    break
+                nxt = None
+                for j in targets:
+                    vj = self.ACTION.get((j, a))
+                    if (vj is None or vj[0] != 'reduce'
+                            or (nxt is not None and vj[1] != nxt)):
+                        nxt = None
+                        break
+                    nxt = vj[1]
+                if nxt is None:
+                    break
+                n = nxt
+                chain.append(n)
+                cur = targets
+            if len(chain) > 1:
+                key = tuple(chain)
+                if key not in chain_index:
+                    chain_index[key] = len(chains)
+                    chains.append(key)
+                idx = s * n_sym + sym_id[a]
+                atag[idx] = 4
+                aarg[idx] = chain_index[key]
+        self._action_chain = chains
+
+    def _pack_table(self, table, sym_id):
+        """Rekeys a C{(state, symbol)} table by small integer symbol
+        ids: the shelved form pickles far more compactly and loads
+        with int hashing instead of string hashing"""
+        return dict(((i, sym_id[a]), v) for (i, a), v in table.items())
+
+    def _unpack_table(self, table, symbols):
+        """Inverse of L{_pack_table}"""
+        return dict(((i, symbols[k]), v) for (i, k), v in table.items())
 
     def __str__(self):
         """@return: the LR parsing table showing for each state the
         action and goto function """
-        l = [x[0] for x in self.ACTION]
-        l.sort()
-        a1 = "\nState\n"
+        states = sorted({x[0] for x in self.ACTION})
+        parts = ["\nState\n"]
         if len(self.terminals) < 20:
             for a in self.terminals:
-                a1 = a1 + " \t%s" % a
-            for i in osets.Set(l):
-                a3 = "\n%s" % i
+                parts.append(" \t%s" % a)
+            for i in states:
+                parts.append("\n%s" % i)
                 for a in self.terminals:
                     if (i, a) in self.ACTION:
                         if self.ACTION[i, a][0] == "shift":
                             x = "s"
                         else:
                             x = "r"
-                        a2 = "\t%s%s" % (x, self.ACTION[i, a][1])
+                        parts.append("\t%s%s" % (x, self.ACTION[i, a][1]))
                     else:
-                        a2 = "\t"
-                    a3 = a3+a2
-                a1 = "%s%s" % (a1, a3)
-            ac = a1
+                        parts.append("\t")
         else:
-            for i in osets.Set(l):
-                a3 = "%s\n" % i
+            for i in states:
+                parts.append("%s\n" % i)
                 for a in self.terminals:
                     if (i, a) in self.ACTION:
                         if self.ACTION[i, a][0] == "shift":
                             x = "s"
                         else:
                             x = "r"
-                        a3 = a3 + "%s = %s%s\n" % (a, x, self.ACTION[i, a][1])
-                a1 = "%s%s" % (a1, a3)
-            ac = a1
-        l = [x[0] for x in self.GOTO]
-        l.sort()
-        a1 = "\nState\n"
+                        parts.append("%s = %s%s\n" %
+                                     (a, x, self.ACTION[i, a][1]))
+        ac = "".join(parts)
+        states = sorted({x[0] for x in self.GOTO})
+        parts = ["\nState\n"]
         if len(self.nonterminals) < 20:
             for a in self.nonterminals:
-                a1 = a1 + " \t%s" % a
-            for i in osets.Set(l):
-                a3 = "\n%s" % i
+                parts.append(" \t%s" % a)
+            for i in states:
+                parts.append("\n%s" % i)
                 for a in self.nonterminals:
                     if (i, a) in self.GOTO:
-                        a2 = "\t%s" % self.GOTO[(i, a)]
+                        parts.append("\t%s" % self.GOTO[(i, a)])
                     else:
-                        a2 = "\t"
-                    a3 = a3 + a2
-                a1 = "%s%s" % (a1, a3)
+                        parts.append("\t")
         else:
-            for i in osets.Set(l):
-                a3 = "%s\n" % i
+            for i in states:
+                parts.append("%s\n" % i)
                 for a in self.nonterminals:
                     if (i, a) in self.GOTO:
-                        a3 = a3 + "%s = %s\n" % (a, self.GOTO[(i, a)])
-                a1 = "%s%s" % (a1, a3)
-        go = a1
+                        parts.append("%s = %s\n" % (a, self.GOTO[(i, a)]))
+        go = "".join(parts)
         return "Action table:\n %s\n Goto table:%s\n" % (ac, go)
 
     def parsing(self, tokens, context=None):
@@ -1541,58 +2056,120 @@ class LRparser:
 
         @return: parsed result
         """
-        self.stack = Stack()
-        self.stack.push((0, []))
+        """ the stack is a bare list of (state, value) pairs; the hot
+        loop indexes it with [-1] and binds the tables and rules to
+        locals, avoiding attribute and method dispatch per token """
+        stack = self.stack = [(0, [])]
         self.tokens = tokens
         self.tokens.append((self.endmark, self.endmark))
         self.context = context
-        self.output = []
-        self.ip = 0
-        while 1:
-            s = self.stack.top()[0]
-            a = self.tokens[self.ip][0]
-            if _DEBUG:
-                print("Input: %s\nState: %s" %
-                      ([x[0] for x in self.tokens[self.ip:]], s))
-                print("Stack: %s" % self.stack)
-            try:
-                if self.ACTION[s, a][0] == 'shift':
-                    if _DEBUG:
-                        print("Action: shift\n")
-                    self.stack.push((self.ACTION[s, a][1],
-                                     self.tokens[self.ip][1]))
-                    self.ip = self.ip + 1
-                elif self.ACTION[s, a][0] == 'reduce':
-                    n = self.ACTION[s, a][1]
-                    if _DEBUG:
-                        print("Action: reduce %s %s\n" %
-                              (n, str(self.rules[n])))
-                    semargs = [self.stack.pop()[1]
-                               for i in range(len(self.rules[n][1]))]
-                    semargs.reverse()
-                    if self.nosemrules:
-                        reduce = []
-                    else:
-                        reduce = Reduction(self.rules[n][2],
-                                           semargs, self.context)
-                    del semargs
-                    s1 = self.stack.top()[0]
-                    a = self.rules[n][0]
-                    self.stack.push((self.GOTO[s1, a], reduce))
-                    self.output.append(n)
-                elif self.ACTION[s, a] == ('accept', []):
-                    break
-                else:
-                    raise LRParserError(s, a)
-            except KeyError:
-                if _DEBUG:
-                    print("Error in action: %s" % self.ACTION)
-                raise LRParserError(s, a)
-            except SemanticError as m:
+        output = self.output = []
+        rules = self.rules
+        rule_info = self._rule_info
+        nosemrules = self.nosemrules
+        """ packed-table fast path: one multiply-add and an array load
+        per step instead of a tuple-keyed dict probe """
+        sym_id = self._sym_id
+        action_tag = self._action_tag
+        action_arg = self._action_arg
+        goto_arr = self._goto_arr
+        lhs_id = self._lhs_id
+        action_chain = self._action_chain
+        n_sym = self._n_sym
+        """ translate the token symbols to integer ids once, instead
+        of hashing the current symbol again on every reduce step """
+        tok_ids = [sym_id.get(t[0]) for t in tokens]
+        ip = self.ip = 0
+        try:
+            while 1:
+                s = stack[-1][0]
+                a = tokens[ip][0]
                 if _DEBUG:
-                    print("Semantic Rule %d %s" % (n, self.rules[n][2]))
-                raise SemanticError(m, n, self.rules[n][2])
-        return self.stack.top()[1]
+                    print("Input: %s\nState: %s" %
+                          ([x[0] for x in tokens[ip:]], s))
+                    print("Stack: %s" % stack)
+                try:
+                    ai = tok_ids[ip]
+                    if ai is None:
+                        raise LRParserError(s, a)
+                    idx = s * n_sym + ai
+                    tag = action_tag[idx]
+                    if tag == 1:
+                        """ shift """
+                        if _DEBUG:
+                            print("Action: shift\n")
+                        stack.append((action_arg[idx], tokens[ip][1]))
+                        ip = ip + 1
+                    elif tag == 2:
+                        """ reduce """
+                        n = action_arg[idx]
+                        if _DEBUG:
+                            print("Action: reduce %s %s\n" %
+                                  (n, str(rules[n])))
+                        lhs, rlen, sem = rule_info[n]
+                        if nosemrules:
+                            if rlen:
+                                del stack[-rlen:]
+                            reduce = []
+                        else:
+                            m = len(stack) - rlen
+                            semargs = [x[1] for x in stack[m:]]
+                            del stack[m:]
+                            """ the two trivial stock rules are
+                            inlined by identity, skipping a Python
+                            call per reduce """
+                            if sem is DefaultSemRule:
+                                reduce = semargs[0]
+                            elif sem is EmptySemRule:
+                                reduce = []
+                            else:
+                                reduce = Reduction(sem, semargs, context)
+                            del semargs
+                        j = goto_arr[stack[-1][0] * n_sym + lhs_id[n]]
+                        if j < 0:
+                            raise LRParserError(s, a)
+                        stack.append((j, reduce))
+                        output.append(n)
+                    elif tag == 3:
+                        """ accept """
+                        break
+                    elif tag == 4:
+                        """ folded reduce cascade: each rule is applied
+                        exactly as a plain reduce, without going back
+                        through the table dispatch in between """
+                        for n in action_chain[action_arg[idx]]:
+                            if _DEBUG:
+                                print("Action: reduce %s %s\n" %
+                                      (n, str(rules[n])))
+                            lhs, rlen, sem = rule_info[n]
+                            if nosemrules:
+                                if rlen:
+                                    del stack[-rlen:]
+                                reduce = []
+                            else:
+                                m = len(stack) - rlen
+                                semargs = [x[1] for x in stack[m:]]
+                                del stack[m:]
+                                if sem is DefaultSemRule:
+                                    reduce = semargs[0]
+                                elif sem is EmptySemRule:
+                                    reduce = []
+                                else:
+                                    reduce = Reduction(sem, semargs, context)
+                            j = goto_arr[stack[-1][0] * n_sym + lhs_id[n]]
+                            if j < 0:
+                                raise LRParserError(s, a)
+                            stack.append((j, reduce))
+                            output.append(n)
+                    else:
+                        raise LRParserError(s, a)
+                except SemanticError as m:
+                    if _DEBUG:
+                        print("Semantic Rule %d %s" % (n, rules[n][2]))
+                    raise SemanticError(m, n, rules[n][2])
+        finally:
+            self.ip = ip
+        return stack[-1][1]
 
     def parse_grammar(self, st, context, args):
         """
@@ -1614,7 +2191,15 @@ class LRparser:
         -  csemsym=E{rb}E{rb} semantic rule end marker
         -  rulesep='|' separator for multiple rules for a LHS
         -  ruleend=';' end marker for one LHS rule"""
-        self.pg = Yappy_grammar(**args)
+        """ the Yappy grammar parser (lexer plus LR1 table for the
+        meta-grammar) is the same for every grammar string, so one
+        instance per argument set is built and reused; the parsed
+        rules themselves hold live callables from the caller's
+        context, so they cannot be cached across contexts """
+        key = repr(sorted(args.items()))
+        self.pg = _pg_cache.get(key)
+        if self.pg is None:
+            self.pg = _pg_cache[key] = Yappy_grammar(**args)
         self.pg.input(st, context)
         return self.pg.context['rules']
 
@@ -1646,62 +2231,77 @@ class LRparser:
                        rulesep='|',
                        ruleend=';')
         gr = []
-        rl = str.split(rulestr, sym['ruleend'])
-        for l in rl:
-            m = re.compile(sym['rulesym']).search(l)
-            if not m:
-                continue
-            else:
-                if m.start() == 0:
-                    raise GrammarError(l)
+        """Most alternatives repeat the same few semantic-rule names,
+        so each distinct name is eval'ed only once"""
+        ev_cache = {}
+        intern = sys.intern
+        """One compiled alternation swept over the whole rule string
+        with finditer, instead of one split or search pass per
+        delimiter per rule: each character is looked at once"""
+        token_re = re.compile(
+            re.escape(sym['semsym']) + '(?P<opsem>.*?)'
+            + re.escape(sym['csemsym'])
+            + '|(?P<rulesym>' + sym['rulesym'] + ')'
+            + '|(?P<rulesep>' + re.escape(sym['rulesep']) + ')'
+            + '|(?P<ruleend>' + re.escape(sym['ruleend']) + ')')
+        lhs = None
+        opsem = None
+        buf = []
+        pos = 0
+        for m in token_re.finditer(rulestr):
+            buf.append(rulestr[pos:m.start()])
+            pos = m.end()
+            kind = m.lastgroup
+            if kind == 'opsem':
+                opsem = m.group('opsem')
+            elif kind == 'rulesym':
+                if lhs is not None:
+                    """a production symbol inside a RHS stays plain text"""
+                    buf.append(m.group())
                 else:
-                    lhs = l[0:m.start()].strip()
-                if m.end() == len(l):
-                    raise GrammarError(l)
+                    lhs = "".join(buf).strip()
+                    buf = []
+                    if not lhs:
+                        raise GrammarError(rulestr[:m.end()])
+                    lhs = intern(lhs)
+            elif lhs is None:
+                """text without a production symbol is skipped, as the
+                split-based code did with such rule chunks"""
+                buf = []
+            else:
+                """rulesep or ruleend closes the current alternative"""
+                rest = "".join(buf).strip()
+                buf = []
+                if rest == "[]" and opsem is None:
+                    gr.append((lhs, [], EmptySemRule))
                 else:
-                    rhss = str.strip(l[m.end():])
-                    if rhss == "[]":
-                        rhs = []
-                        sem = EmptySemRule
-                        op = None
+                    rhs = [intern(s) for s in rest.split()]
+                    if opsem is not None and not rhs:
+                        raise GrammarError(rest)
+                    if not opsem:
+                        gr.append((lhs, rhs, DefaultSemRule))
                     else:
-                        rhss = str.split(l[m.end():], sym['rulesep'])
-                        for rest in rhss:
-                            rest = str.strip(rest)
-                            if rhss == "[]":
-                                rhs = []
-                                sem = EmptySemRule
-                                op = None
-                            else:
-                                m = re.search(sym['semsym']+'(?P<opsem>.*)'
-                                              + sym['csemsym'], rest)
-                                if not m:
-                                    rhs = str.split(rest, None)
-                                    sem = DefaultSemRule
-                                    op = None
-                                else:
-                                    if m.start() == 0:
-                                        raise GrammarError(rest)
-                                    else:
-                                        rhs = str.split(rest[0:m.start()].strip())
-                                    if m.group('opsem'):
-                                        opsem = str.split(m.group('opsem'),
-                                                          sym['opsym'])
-                                        if len(opsem) == 1:
-                                            sem = str.strip(opsem[0])
-                                            op = None
-                                        elif len(opsem) == 2:
-                                            sem = str.strip(opsem[0])
-                                            op = str.strip(opsem[1])
-                                        else:
-                                            raise GrammarError(rest)
-                                    else:
-                                        sem = DefaultSemRule
-                                        op = None
-                                if op is None:
-                                    gr.append((lhs, rhs, eval(sem)))
-                                else:
-                                    gr.append((lhs, rhs, eval(sem), eval(op)))
+                        opsem_l = str.split(opsem, sym['opsym'])
+                        if len(opsem_l) == 1:
+                            sem = str.strip(opsem_l[0])
+                            op = None
+                        elif len(opsem_l) == 2:
+                            sem = str.strip(opsem_l[0])
+                            op = str.strip(opsem_l[1])
+                        else:
+                            raise GrammarError(rest)
+                        if sem not in ev_cache:
+                            ev_cache[sem] = eval(sem)
+                        if op is None:
+                            gr.append((lhs, rhs, ev_cache[sem]))
+                        else:
+                            if op not in ev_cache:
+                                ev_cache[op] = eval(op)
+                            gr.append((lhs, rhs, ev_cache[sem],
+                                       ev_cache[op]))
+                opsem = None
+                if kind == 'ruleend':
+                    lhs = None
         return gr
 
 
@@ -1713,41 +2313,90 @@ class LRBuildparser:
         """
         """
         self.table = LALRtable(grammar)
+        """Flat per-rule arrays so a reduce reads an int and a string
+        instead of indexing into the rule tuples"""
+        self.rhs_len = [len(r[1]) for r in self.table.gr.rules]
+        self.lhs = [r[0] for r in self.table.gr.rules]
+        """Both tables flattened into sign-encoded array('i')s indexed
+        by state * n_sym + symbol id: shift to state j is j+1, reduce
+        by rule n is -(n+1), accept is one past the largest shift and
+        0 is error, so the parse loop does a multiply-add, one array
+        load and a sign test instead of a dict probe"""
+        symbols = self.table.gr.terminals + self.table.gr.nonterminals
+        self._sym_id = sym_id = {}
+        for k in range(len(symbols)):
+            sym_id[symbols[k]] = k
+        self._n_sym = n_sym = len(symbols)
+        n_states = 0
+        for (s, a), v in self.table.ACTION.items():
+            n_states = max(n_states, s + 1)
+            if v[0] == 'shift':
+                n_states = max(n_states, v[1] + 1)
+        for (s, a), j in self.table.GOTO.items():
+            n_states = max(n_states, s + 1, j + 1)
+        self._accept = n_states + 1
+        self._action_arr = aarr = array('i', [0]) * (n_states * n_sym)
+        for (s, a), v in self.table.ACTION.items():
+            idx = s * n_sym + sym_id[a]
+            if v[0] == 'shift':
+                aarr[idx] = v[1] + 1
+            elif v[0] == 'reduce':
+                aarr[idx] = -(v[1] + 1)
+            else:
+                aarr[idx] = self._accept
+        self._goto_arr = garr = array('i', [0]) * (n_states * n_sym)
+        for (s, a), j in self.table.GOTO.items():
+            garr[s * n_sym + sym_id[a]] = j + 1
+        self._lhs_id = array('i', [sym_id[r[0]]
+                                   for r in self.table.gr.rules])
 
     def parsing(self, tokens):
         """LR Parsing Algorithm
         """
         self.stack = Stack()
         self.stack.push(0)
-        self.input = tokens
-        self.input.append(self.table.gr.endmark)
+        """the endmark goes on a copy: the caller keeps its list"""
+        self.input = tokens + [self.table.gr.endmark]
         self.output = []
         self.ip = 0
+        """Bind the hot lookups to locals once, outside the loop"""
+        action_arr = self._action_arr
+        goto_arr = self._goto_arr
+        accept = self._accept
+        lhs_id = self._lhs_id
+        n_sym = self._n_sym
+        rhs_len = self.rhs_len
+        lhs = self.lhs
+        inp = self.input
+        stack = self.stack.stack
+        output = self.output
+        """the input symbols are mapped to their ids in one pass"""
+        sym_id = self._sym_id
+        ids = [sym_id.get(a) for a in inp]
         while 1:
-            s = self.stack.top()
-            a = self.input[self.ip]
-            if (s, a) not in self.table.ACTION:
-                raise LRParserError(s, a)
-            elif self.table.ACTION[s, a][0] == 'shift':
-                # self.stack.push(a)
-                self.stack.push(self.table.ACTION[s, a][1])
+            s = stack[-1]
+            ai = ids[self.ip]
+            if ai is None:
+                raise LRParserError(s, inp[self.ip])
+            code = action_arr[s * n_sym + ai]
+            if code > 0:
+                if code == accept:
+                    break
+                stack.append(code - 1)
                 self.ip = self.ip + 1
-            elif self.table.ACTION[s, a][0] == 'reduce':
-                n = self.table.ACTION[s, a][1]
-                for i in range(len(self.table.gr.rules[n][1])):
-                    self.stack.pop()
-                s1 = self.stack.top()
-                a = self.table.gr.rules[n][0]
-                #                self.stack.push(a)
-                if (s1, a) not in self.table.GOTO:
-                    raise LRParserError(s1, a)
-                else:
-                    self.stack.push(self.table.GOTO[s1, a])
-                    self.output.append(n)
-            elif self.table.ACTION[s, a] == ('accept', []):
-                break
+            elif code < 0:
+                n = -code - 1
+                k = rhs_len[n]
+                if k:
+                    del stack[-k:]
+                s1 = stack[-1]
+                j = goto_arr[s1 * n_sym + lhs_id[n]]
+                if not j:
+                    raise LRParserError(s1, lhs[n])
+                stack.append(j - 1)
+                output.append(n)
             else:
-                raise LRParserError()
+                raise LRParserError(s, inp[self.ip])
 
 
 # ############ Auxiliares  ##################
@@ -1771,6 +2420,7 @@ def grules(rules_list, rulesym="->", rhssep=None):
     """
     gr = []
     sep = re.compile(rulesym)
+    intern = sys.intern
     for r in rules_list:
         if isinstance(r, str):
             rule = r
@@ -1783,7 +2433,7 @@ def grules(rules_list, rulesym="->", rhssep=None):
             if m.start() == 0:
                 raise GrammarError(rule)
             else:
-                lhs = rule[0:m.start()].strip()
+                lhs = intern(rule[0:m.start()].strip())
             if m.end() == len(rule):
                 raise GrammarError(rule)
             else:
@@ -1791,7 +2441,7 @@ def grules(rules_list, rulesym="->", rhssep=None):
                 if rest == "[]":
                     rhs = []
                 else:
-                    rhs = str.split(rest, rhssep)
+                    rhs = [intern(s) for s in str.split(rest, rhssep)]
         if isinstance(r, str):
             gr.append((lhs, rhs, DefaultSemRule))
         elif len(r) == 3:
@@ -1831,7 +2481,7 @@ class Yappy(LRparser):
         if isinstance(grammar, str):
             grammar = self.parse_grammar(grammar, {'locals': locals()}, args)
         if 'usrdir' in args and os.path.isdir(args['usrdir']):
-            table = string.rstrip(args['usrdir']) + '/' + table
+            table = args['usrdir'].rstrip() + '/' + table
         if (os.path.dirname(table) == ""
                 or os.path.exists(os.path.dirname(table))):
             LRparser.__init__(self, grammar, table, no_table, tabletype,
@@ -1907,12 +2557,18 @@ class Yappy(LRparser):
 
 
 # ######## Semantic Grammar Rules ##############
+_regargs = re.compile(r'\$(\d+)')
+
+
 def expandSemRule(strargs, strfun):
-    regargs = re.compile(r'\$(\d+)')
-    matchargs = regargs.finditer(strfun)
-    for i in [(x.group(0), strargs+x.group(1)+"]") for x in matchargs]:
-        strfun = string.replace(strfun, i[0], i[1])
-    return strfun
+    """Expands each positional C{$n} into C{strargs + n + "]"} with a
+    single sub pass over the string"""
+    return _regargs.sub(lambda x: strargs + x.group(1) + "]", strfun)
+
+
+_sem_code = {}
+"""expanded-and-compiled string semantic rules, keyed by the rule
+source: a rule fires once per reduce but is compiled only once"""
 
 
 def Reduction(fun, sargs, context={}):
@@ -1926,7 +2582,10 @@ def Reduction(fun, sargs, context={}):
     if callable(fun):
         return fun(*[sargs, context])
     elif isinstance(fun, str):
-        a = expandSemRule("sargs[", fun)
+        a = _sem_code.get(fun)
+        if a is None:
+            a = _sem_code[fun] = compile(expandSemRule("sargs[", fun),
+                                         '<semrule>', 'eval')
         l = context.get('locals', {})
         l.update(locals())
         return eval(a, context.get('globals', {}), l)
@@ -1943,6 +2602,26 @@ def EmptySemRule(sargs, context={}):
     return []
 
 
+def _grule(lhs, l, ev_cache, ctx_locals):
+    """Builds one rule tuple for L{Yappy_grammar.RULERule}.  Module
+    level, so no closure is rebuilt per parsed rule; alternatives
+    overwhelmingly repeat the same semantic-rule names (e.g.
+    C{DefaultSemRule}), so each name is eval'ed once per parsed
+    grammar via C{ev_cache} instead of once per alternative."""
+    if l == []:
+        return (lhs, [], EmptySemRule)
+    if isinstance(l[1], tuple):
+        sem = l[1][0]
+        if sem not in ev_cache:
+            ev_cache[sem] = eval(sem, globals(), ctx_locals)
+        return (lhs, l[0], ev_cache[sem], l[1][1])
+    else:
+        sem = l[1]
+        if sem not in ev_cache:
+            ev_cache[sem] = eval(sem, globals(), ctx_locals)
+        return (lhs, l[0], ev_cache[sem])
+
+
 # #####Parser f, grammars ##################
 class Yappy_grammar(Yappy):
     """ A parser for grammar rules. See C{test()} for an example. """
@@ -1977,11 +2656,25 @@ class Yappy_grammar(Yappy):
                     ("//", lambda x: ("opsym", x)),
                     (".*", lambda x: ("ID", x))]
         if 'tmpdir' in args:
-            args1 = {'usrdir': string.rstrip(args['tmpdir'], '/')}
+            args1 = {'usrdir': args['tmpdir'].rstrip('/')}
         else:
             args1 = {}
+        self._ev_cache = {}
         Yappy.__init__(self, tokenize, grammar, table, no_table, **args1)
 
+    def input(self, str=None, context={}, lexer=0):
+        """Same as L{Yappy.input} but scans with the fused RE, in a
+        single pass over the grammar string instead of one pass per
+        tokenize rule; for this rule set both scanners agree."""
+        self._ev_cache = {}
+        if str:
+            self.tokens = self.lex.scan_fused(str)
+            if lexer:
+                return self.tokens
+            self.context = context
+            return self.parsing(self.tokens, self.context)
+        return Yappy.input(self, str, context, lexer)
+
     def OPVRule(self, arg, context):
         """ """
         try:
@@ -2013,10 +2706,13 @@ class Yappy_grammar(Yappy):
             return 'DefaultSemRule'
 
     def RHRule(self, arg, context):
+        """the tail lists are owned by this parse, so the new head is
+        put in place instead of copying the list per symbol"""
         if len(arg) == 1:
             return [arg[0]]
         if len(arg) == 2:
-            return [arg[0]]+arg[1]
+            arg[1].insert(0, arg[0])
+            return arg[1]
 
     def RHSRule(self, arg, context):
         return (arg[0], arg[1])
@@ -2025,26 +2721,18 @@ class Yappy_grammar(Yappy):
         if len(arg) == 1:
             return [arg[0]]
         else:
-            return [arg[0]]+arg[2]
+            arg[2].insert(0, arg[0])
+            return arg[2]
 
     def RULERule(self, arg, context):
-        lhs = arg[0]
-
-        def grule(self, l):
-            if l == []:
-                return (lhs, [], EmptySemRule)
-            if isinstance(l[1], tuple):
-                return (lhs, l[0], eval(l[1][0], globals(),
-                        context['locals']), l[1][1])
-            else:
-                return (lhs, l[0], eval(l[1], globals(), context['locals']))
-        return [grule(self, l) for l in arg[2]]
+        ev_cache = self._ev_cache
+        ctx_locals = context['locals']
+        return [_grule(arg[0], l, ev_cache, ctx_locals) for l in arg[2]]
 
     def GRule(self, args, context):
         if 'rules' in context:
-            context['rules'] = args[0] + context['rules']
-        else:
-            context['rules'] = args[0]
+            args[0].extend(context['rules'])
+        context['rules'] = args[0]
         return []
 
     def test(self):
@@ -2073,26 +2761,23 @@ class Yappy_grammar(Yappy):
 class Stack:
     """ A simple class to implement stacks"""
     def __init__(self, start=[]):
-        """Reverse initial stack objects"""
-        self.stack = []
-        for x in start:
-            self.push(x)
+        """The top of the stack is the last element of the list"""
+        self.stack = list(start)
         self.stack.reverse()
 
     def push(self, object):
-        self.stack = [object] + self.stack
+        self.stack.append(object)
 
     def pop(self):
         if not self.stack:
             raise StackUnderflow()
-        top, self.stack = self.stack[0], self.stack[1:]
-        return top
+        return self.stack.pop()
 
     def top(self):
         """ Returns top of stack (not popping it)"""
         if not self.stack:
             raise StackUnderflow()
-        return self.stack[0]
+        return self.stack[-1]
 
     def empty(self):
         """ Tests if stack is empty"""
@@ -2105,10 +2790,6 @@ class Stack:
     def __repr__(self):
         return '[Stack:%s]' % self.stack
 
-    def __cmp__(self, other):
-        cmp = lambda a, b: (a > b) - (a < b)
-        return cmp(self.stack, other.stack)
-
     def __len__(self):
         return len(self.stack)
 
@@ -2120,9 +2801,3 @@ class Stack:
 
     def __getitem__(self, offset):
         return self.stack[offset]
-
-    def __getslice__(self, low, high):
-        return Stack(self.stack[low:high])
-
-    def __getattr__(self, name):
-        return getattr(self.stack, name)